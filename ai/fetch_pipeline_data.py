@@ -15,27 +15,97 @@ Requires: BACKEND_URL (e.g. http://localhost:3000)
 """
 
 import argparse
+import asyncio
+import csv
+import gzip
+import json
 import os
 import sys
-from concurrent.futures import ThreadPoolExecutor, as_completed
-from datetime import datetime, timezone
+import threading
+from collections.abc import Callable
+from concurrent.futures import Future, ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
 from pathlib import Path
 
+import httpx
+import numpy as np
 import pandas as pd
 import requests
+from requests.adapters import HTTPAdapter
+from requests_cache import DO_NOT_CACHE, CachedSession
+from urllib3.util.retry import Retry
+
+from pipeline_csv import write_csv
+
+try:
+    from orjson import loads as _loads
+except ImportError:  # optional speed-up; stdlib json parses the same payloads
+    _loads = json.loads
+
+# Seconds to establish a connection; separate from read timeouts so an unreachable backend fails fast.
+CONNECT_TIMEOUT = 3
+CACHE_PATH = Path(__file__).with_name("pipeline_cache.sqlite")  # next to the script, whatever the cwd
+CACHE_EXPIRE_AFTER = timedelta(hours=6)
+# Heat changes every run; only census population and facility counts are worth caching.
+CACHE_URLS_EXPIRE_AFTER = {
+    "*/barangay-temperatures": DO_NOT_CACHE,
+    "*/barangay-heat-risk": DO_NOT_CACHE,
+}
+
+
+def _json(r: "requests.Response | httpx.Response"):
+    """Parse a response body straight from bytes (orjson when installed); errors match r.json()."""
+    try:
+        return _loads(r.content)
+    except json.JSONDecodeError as e:  # orjson.JSONDecodeError subclasses it
+        raise requests.JSONDecodeError(e.msg, e.doc, e.pos) from e
+
+
+def build_session(pool_size: int = 32, cache: bool = False) -> requests.Session:
+    """
+    Keep-alive session with a connection pool sized for the worker count; retries connect errors and 502/503/504.
+    With cache=True, GET/POST responses are kept in a local SQLite cache (CACHE_PATH) and revalidated
+    via ETag/Last-Modified when the backend sends them; heat endpoints are never cached.
+    """
+    if cache:
+        session: requests.Session = CachedSession(
+            str(CACHE_PATH),
+            backend="sqlite",
+            expire_after=CACHE_EXPIRE_AFTER,
+            urls_expire_after=CACHE_URLS_EXPIRE_AFTER,
+            cache_control=True,
+            allowable_methods=("GET", "POST"),
+        )
+    else:
+        session = requests.Session()
+    adapter = HTTPAdapter(
+        pool_connections=pool_size,
+        pool_maxsize=pool_size,
+        # read=False: a read timeout is not retried, so a slow heat call costs one --timeout, not three.
+        max_retries=Retry(total=2, read=False, backoff_factor=0.2, status_forcelist=[502, 503, 504]),
+    )
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    session.headers["Connection"] = "keep-alive"
+    session.headers["Accept-Encoding"] = "gzip"
+    return session
 
 
-def get_barangay_temperatures(base_url: str, timeout: int = 120) -> dict[str, float]:
+# Shared across helpers so calls to the same backend reuse pooled connections (no handshake per request).
+SESSION = build_session()
+
+
+def get_barangay_temperatures(base_url: str, timeout: int = 120, session: requests.Session = SESSION) -> dict[str, float]:
     """Fetch barangay temperatures from heat API. May take 1–2 min when backend calls Meteosource per barangay."""
     url = f"{base_url.rstrip('/')}/api/heat/davao/barangay-temperatures"
-    r = requests.get(url, timeout=timeout)
+    r = session.get(url, timeout=(CONNECT_TIMEOUT, timeout))
     r.raise_for_status()
-    data = r.json()
+    data = _json(r)
     temps = data.get("temperatures") or {}
     return {str(k): float(v) for k, v in temps.items() if v is not None}
 
 
-def get_barangay_heat_risk(base_url: str, timeout: int = 120) -> tuple[dict[str, float], bool, str]:
+def get_barangay_heat_risk(base_url: str, timeout: int = 120, session: requests.Session = SESSION) -> tuple[dict[str, float], bool, str]:
     """
     Fetch barangay heat-risk from backend. When backend used humidity, risks include heat_index_c (validated).
     Returns (barangay_id -> value to use as temperature, used_heat_index, temperatures_source).
@@ -43,9 +113,9 @@ def get_barangay_heat_risk(base_url: str, timeout: int = 120) -> tuple[dict[str,
     temperatures_source = "meteosource" (per-barangay) or "weatherapi" (city average for all) or "".
     """
     url = f"{base_url.rstrip('/')}/api/heat/davao/barangay-heat-risk"
-    r = requests.get(url, timeout=timeout)
+    r = session.get(url, timeout=(CONNECT_TIMEOUT, timeout))
     r.raise_for_status()
-    data = r.json()
+    data = _json(r)
     risks = data.get("risks") or {}
     out: dict[str, float] = {}
     used_hi = False
@@ -64,23 +134,55 @@ def get_barangay_heat_risk(base_url: str, timeout: int = 120) -> tuple[dict[str,
     return out, used_hi, temperatures_source
 
 
-def get_facility_count(base_url: str, barangay_id: str) -> int:
-    """Fetch facility count for one barangay."""
-    url = f"{base_url.rstrip('/')}/api/facilities/by-barangay/{barangay_id}"
-    r = requests.get(url, timeout=15)
-    if r.status_code == 404:
-        return 0
-    r.raise_for_status()
-    data = r.json()
-    return int(data.get("total") or 0)
+def get_facility_counts_concurrent(
+    base_url: str, barangay_ids: list[str], workers: int = 20, timeout: int = 10
+) -> dict[str, int]:
+    """
+    Fetch facility counts one barangay at a time over a single async client (fallback when batch is missing).
+    HTTP/2 multiplexes the requests on one connection when the backend supports it; at most `workers` in flight.
+    Failed or unknown barangays count as 0.
+    """
+    n = len(barangay_ids)
+    limits = httpx.Limits(max_connections=max(workers, 1), max_keepalive_connections=min(workers, 20))
+
+    async def fetch_all() -> dict[str, int]:
+        done = 0
+        async with httpx.AsyncClient(
+            http2=True,
+            base_url=base_url.rstrip("/"),
+            timeout=httpx.Timeout(timeout, connect=CONNECT_TIMEOUT),
+            limits=limits,
+        ) as client:
+            sem = asyncio.Semaphore(max(workers, 1))
+
+            async def one(bid: str) -> tuple[str, int]:
+                nonlocal done
+                async with sem:
+                    try:
+                        r = await client.get(f"/api/facilities/by-barangay/{bid}")
+                        if r.status_code == 404:
+                            count = 0
+                        else:
+                            r.raise_for_status()
+                            count = int(_json(r).get("total") or 0)
+                    except (httpx.HTTPError, ValueError):
+                        count = 0
+                done += 1
+                if done % 50 == 0 or done == n:
+                    print(f"  {done}/{n} facility counts...", flush=True)
+                return bid, count
+
+            return dict(await asyncio.gather(*(one(bid) for bid in barangay_ids)))
 
+    return asyncio.run(fetch_all())
 
-def get_facility_counts_batch(base_url: str, barangay_ids: list[str], timeout: int = 60) -> dict[str, int]:
+
+def get_facility_counts_batch(base_url: str, barangay_ids: list[str], timeout: int = 60, session: requests.Session = SESSION) -> dict[str, int]:
     """Fetch facility counts for many barangays in one request (faster). Returns { barangay_id: count }."""
     url = f"{base_url.rstrip('/')}/api/facilities/counts-by-barangays"
-    r = requests.post(url, json={"barangayIds": list(barangay_ids)}, timeout=timeout)
+    r = session.post(url, json={"barangayIds": list(barangay_ids)}, timeout=(CONNECT_TIMEOUT, timeout))
     r.raise_for_status()
-    data = r.json()
+    data = _json(r)
     counts = data.get("counts") or {}
     return {str(k): int(v) for k, v in counts.items()}
 
@@ -90,12 +192,17 @@ def facility_count_to_distance(facility_count: int) -> float:
     return 1.0 / (1.0 + facility_count)
 
 
-def get_barangay_population_density(base_url: str, timeout: int = 30) -> dict[str, dict]:
+def facility_counts_to_distance(facility_counts: np.ndarray) -> np.ndarray:
+    """Vectorized facility_count_to_distance for a whole column, rounded to 6 decimals as written to CSV."""
+    return np.round(np.reciprocal(1.0 + facility_counts.astype(np.float64)), 6)
+
+
+def get_barangay_population_density(base_url: str, timeout: int = 30, session: requests.Session = SESSION) -> dict[str, dict]:
     """Fetch population and density per barangay. Returns { barangay_id: { population, density } }."""
     url = f"{base_url.rstrip('/')}/api/heat/davao/barangay-population"
-    r = requests.get(url, timeout=timeout)
+    r = session.get(url, timeout=(CONNECT_TIMEOUT, timeout))
     r.raise_for_status()
-    data = r.json()
+    data = _json(r)
     if not isinstance(data, dict):
         return {}
     out: dict[str, dict] = {}
@@ -112,17 +219,102 @@ def get_barangay_population_density(base_url: str, timeout: int = 30) -> dict[st
     return out
 
 
+def _row_keys(df: pd.DataFrame) -> pd.Series:
+    """(barangay_id, date) dedupe key per row, as stored in the .keys sidecar."""
+    return df["barangay_id"].astype(str) + "|" + df["date"].astype(str)
+
+
+def _ends_with_newline(path: Path, gzipped: bool) -> bool:
+    """True if the file's last byte is a newline (a .gz is decompressed in a streaming pass to find it)."""
+    if gzipped:
+        last = b""
+        with gzip.open(path, "rb") as f:
+            while chunk := f.read(1 << 20):
+                last = chunk[-1:]
+        return last == b"\n"
+    with path.open("rb") as f:
+        f.seek(-1, os.SEEK_END)
+        return f.read(1) == b"\n"
+
+
+def append_csv(df: pd.DataFrame, append_path: Path) -> int:
+    """
+    Append rows to a rolling-history CSV without re-reading it; header is written only for a new file.
+    Rows whose (barangay_id, date) is already in the history are skipped, using a sidecar of keys
+    (append_path with suffix .keys, one "barangay_id|date" per line); rerunning on the same day adds nothing.
+    An existing file whose header lacks some of df's columns, or has no sidecar yet, is read once to migrate;
+    later runs take the append-only path. A .gz history is appended as a new gzip member (still one valid .gz
+    file). Returns the number of rows appended.
+    """
+    keys_path = append_path.with_suffix(".keys")
+    gzipped = append_path.suffix == ".gz"
+    header: list[str] = []
+    if append_path.exists() and append_path.stat().st_size > 0:
+        opener = gzip.open if gzipped else open
+        with opener(append_path, "rt", newline="", encoding="utf-8") as f:
+            header = next(csv.reader(f), [])
+    existing_keys: set[str] = set()
+    rebuild_keys = True
+    if header:
+        missing = [c for c in df.columns if c not in header]
+        if missing:
+            existing = pd.read_csv(append_path)
+            header = [*header, *missing]
+            write_csv(existing.reindex(columns=header), append_path)  # same formatting/line endings as appends
+        df = df.reindex(columns=header)
+        if keys_path.exists():
+            existing_keys = set(keys_path.read_text(encoding="utf-8").splitlines())
+            rebuild_keys = False
+        else:
+            existing_keys = set(_row_keys(pd.read_csv(append_path, usecols=["barangay_id", "date"], dtype=str)))
+
+    keys = _row_keys(df)
+    is_new = ~keys.isin(existing_keys)
+    df, keys = df[is_new], keys[is_new]
+    # A history not ending in a newline (e.g. after a hand edit) would glue today's first row onto its last record.
+    newline_first = bool(header) and not _ends_with_newline(append_path, gzipped)
+    if gzipped:
+        out = gzip.open(append_path, "ab", compresslevel=1)
+    else:
+        out = append_path.open("ab", buffering=1 << 20)
+    with out as f:
+        if newline_first:
+            f.write(b"\n")
+        write_csv(df, f, include_header=not header)
+    with keys_path.open("w" if rebuild_keys else "a", encoding="utf-8", newline="\n") as f:
+        if rebuild_keys:
+            f.writelines(f"{k}\n" for k in existing_keys)
+        f.writelines(f"{k}\n" for k in keys)
+    return len(df)
+
+
+def submit_daemon(fn: Callable[[], object]) -> Future:
+    """Run fn on a daemon thread and return its Future; unlike an executor worker, it never delays exit."""
+    future: Future = Future()
+
+    def run() -> None:
+        if not future.set_running_or_notify_cancel():
+            return
+        try:
+            future.set_result(fn())
+        except BaseException as e:
+            future.set_exception(e)
+
+    threading.Thread(target=run, daemon=True).start()
+    return future
+
+
 def main() -> int:
     parser = argparse.ArgumentParser(description="Fetch heat + facilities data from backend for AI pipeline")
     parser.add_argument(
         "--output",
         default="barangay_data_today.csv",
-        help="Output CSV path (today's snapshot)",
+        help="Output CSV path (today's snapshot; gzip-compressed if the path ends in .gz)",
     )
     parser.add_argument(
         "--append",
         metavar="CSV",
-        help="Append today's rows to this CSV (e.g. barangay_data.csv) for rolling history",
+        help="Append today's rows to this CSV (e.g. barangay_data.csv) for rolling history; a .gz path stays gzip-compressed",
     )
     parser.add_argument(
         "--backend",
@@ -133,7 +325,7 @@ def main() -> int:
         "--timeout",
         type=int,
         default=120,
-        help="Timeout in seconds for heat API (default 120; increase if Meteosource is slow)",
+        help="Read timeout in seconds for heat API (default 120; increase if Meteosource is slow). Connecting is capped at 3s",
     )
     parser.add_argument(
         "--workers",
@@ -141,29 +333,45 @@ def main() -> int:
         default=20,
         help="Concurrent requests for facility counts (default 20)",
     )
+    parser.add_argument(
+        "--no-cache",
+        action="store_true",
+        help=f"Bypass the local response cache ({CACHE_PATH.name}) for population and facility counts",
+    )
     args = parser.parse_args()
 
     base_url = args.backend.rstrip("/")
+    session = build_session(max(args.workers, 3), cache=not args.no_cache)
     today = datetime.now(timezone.utc).strftime("%Y-%m-%d")
 
-    # Fetch heat and population in parallel (heat is the long pole; population is fast).
-    print(f"Requesting heat and population from {base_url} (timeout={args.timeout}s) ...", flush=True)
+    # Fetch heat, population and facility counts in parallel (heat is the long pole; the others overlap it).
+    print(f"Requesting heat, population and facility counts from {base_url} (timeout={args.timeout}s) ...", flush=True)
     temperatures: dict[str, float] = {}
     used_heat_index = False
     population_density: dict[str, dict] = {}
 
     def fetch_heat() -> tuple[dict[str, float], bool, str]:
         try:
-            return get_barangay_heat_risk(base_url, timeout=args.timeout)
+            return get_barangay_heat_risk(base_url, timeout=args.timeout, session=session)
         except requests.RequestException:
             return ({}, False, "")
 
     def fetch_population() -> dict[str, dict]:
         try:
-            return get_barangay_population_density(base_url, timeout=min(60, args.timeout))
+            return get_barangay_population_density(base_url, timeout=min(60, args.timeout), session=session)
         except (requests.RequestException, AttributeError, TypeError, ValueError):
             return {}
 
+    def fetch_facilities() -> dict[str, int] | None:
+        # Empty barangayIds = all barangays, so this does not wait for heat to return the ids.
+        try:
+            return get_facility_counts_batch(base_url, [], session=session)
+        except (requests.RequestException, TypeError, ValueError):
+            return None
+
+    # The facility batch may still be in flight after heat returns; its result is collected once the rest of
+    # the frame is built. It runs on a daemon thread so an early error return does not wait for it at exit.
+    fut_fac = submit_daemon(fetch_facilities)
     with ThreadPoolExecutor(max_workers=2) as executor:
         fut_heat = executor.submit(fetch_heat)
         fut_pop = executor.submit(fetch_population)
@@ -172,7 +380,7 @@ def main() -> int:
 
     if not temperatures:
         try:
-            temperatures = get_barangay_temperatures(base_url, timeout=args.timeout)
+            temperatures = get_barangay_temperatures(base_url, timeout=args.timeout, session=session)
             print("  Using temperatures from barangay-temperatures (source unknown).", flush=True)
         except requests.RequestException as e:
             print(f"Error fetching temperatures: {e}", file=sys.stderr)
@@ -196,60 +404,60 @@ def main() -> int:
     n = len(temperatures)
     barangay_ids = list(temperatures.keys())
 
-    # Prefer batch endpoint (1 request); fall back to parallel per-barangay requests
-    facility_counts: dict[str, int] = {}
-    try:
-        print(f"Fetched temperatures for {n} barangays. Fetching facility counts (batch)...", flush=True)
-        facility_counts = get_facility_counts_batch(base_url, barangay_ids)
-        if len(facility_counts) < n:
-            for bid in barangay_ids:
-                if bid not in facility_counts:
-                    facility_counts[bid] = 0
-    except requests.RequestException as e:
-        print(f"  Batch not available ({e}), using {args.workers} parallel requests...", flush=True)
-        def fetch_one(bid: str) -> tuple[str, int]:
-            try:
-                return (bid, get_facility_count(base_url, bid))
-            except requests.RequestException:
-                return (bid, 0)
-
-        done = 0
-        with ThreadPoolExecutor(max_workers=args.workers) as executor:
-            futures = {executor.submit(fetch_one, bid): bid for bid in barangay_ids}
-            for future in as_completed(futures):
-                barangay_id, count = future.result()
-                facility_counts[barangay_id] = count
-                done += 1
-                if done % 50 == 0 or done == n:
-                    print(f"  {done}/{n} facility counts...", flush=True)
-
-    rows = [
+    # Column-wise construction: one array per column aligned to barangay_ids (no per-row dicts).
+    # Built before waiting on facility counts so it overlaps the batch request.
+    no_population: dict = {}
+    temps = np.fromiter((temperatures[bid] for bid in barangay_ids), dtype=np.float64, count=n)
+    pop = np.fromiter(
+        (population_density.get(bid, no_population).get("population", 0) for bid in barangay_ids),
+        dtype=np.int64,
+        count=n,
+    )
+    dens = np.fromiter(
+        (population_density.get(bid, no_population).get("density", 0) for bid in barangay_ids),
+        dtype=np.float64,
+        count=n,
+    )
+    df = pd.DataFrame(
         {
-            "barangay_id": barangay_id,
-            "date": today,
-            "temperature": round(temp, 2),
-            "facility_distance": round(facility_count_to_distance(facility_counts.get(barangay_id, 0)), 6),
-            "population": population_density.get(barangay_id, {}).get("population", 0),
-            "density": round(population_density.get(barangay_id, {}).get("density", 0), 4),
+            "barangay_id": barangay_ids,
+            "date": pd.Categorical.from_codes(np.zeros(n, dtype=np.int8), categories=[today]),
+            "temperature": np.round(temps, 2),
+            "population": pop,
+            "density": np.round(dens, 4),
         }
-        for barangay_id, temp in temperatures.items()
-    ]
+    )
 
-    df = pd.DataFrame(rows)
+    # Prefer batch endpoint (1 request, already fetched alongside heat); fall back to an explicit-id batch
+    # (older backends reject an empty list), then to concurrent per-barangay requests.
+    facility_counts: dict[str, int] = {}
+    all_facility_counts = fut_fac.result()
+    if all_facility_counts is not None:
+        print(f"Fetched temperatures for {n} barangays; facility counts (batch) fetched alongside.", flush=True)
+        facility_counts = {bid: all_facility_counts.get(bid, 0) for bid in barangay_ids}
+    else:
+        try:
+            print(f"Fetched temperatures for {n} barangays. Fetching facility counts (batch)...", flush=True)
+            facility_counts = get_facility_counts_batch(base_url, barangay_ids, session=session)
+            if len(facility_counts) < n:
+                for bid in barangay_ids:
+                    if bid not in facility_counts:
+                        facility_counts[bid] = 0
+        except requests.RequestException as e:
+            print(f"  Batch not available ({e}), using {args.workers} concurrent requests...", flush=True)
+            facility_counts = get_facility_counts_concurrent(base_url, barangay_ids, workers=args.workers)
+
+    fc = np.fromiter((facility_counts.get(bid, 0) for bid in barangay_ids), dtype=np.int32, count=n)
+    df.insert(3, "facility_distance", facility_counts_to_distance(fc))
 
     if args.append:
         append_path = Path(args.append)
-        if append_path.exists():
-            existing = pd.read_csv(append_path)
-            for c in df.columns:
-                if c not in existing.columns:
-                    existing[c] = pd.NA
-            df = pd.concat([existing, df], ignore_index=True)
-        df.to_csv(append_path, index=False)
-        print(f"Appended {len(rows)} rows to {append_path}", flush=True)
+        appended = append_csv(df, append_path)
+        skipped = f" ({n - appended} already present)" if appended < n else ""
+        print(f"Appended {appended} rows to {append_path}{skipped}", flush=True)
     else:
-        df.to_csv(args.output, index=False)
-        print(f"Wrote {len(rows)} rows to {args.output}", flush=True)
+        write_csv(df, args.output)
+        print(f"Wrote {n} rows to {args.output}", flush=True)
 
     return 0
 
@@ -0,0 +1,72 @@
+"""
+CSV output shared by fetch_pipeline_data.py and weighted_heat_risk_pipeline.py.
+
+Uses pyarrow's CSV writer (columns formatted in C++) when pyarrow is installed; otherwise pandas to_csv.
+Paths ending in .gz are written gzip-compressed at level 1 (fast; CSVs still shrink several-fold).
+An open file handle is written as given; callers appending to a .gz wrap it themselves (see append_csv).
+"""
+
+import csv
+import gzip
+import io
+from pathlib import Path
+from typing import BinaryIO
+
+import numpy as np
+import pandas as pd
+
+try:
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    import pyarrow.csv as pacsv
+except ImportError:  # optional speed-up; for the column types it writes, the text matches pandas to_csv
+    pa = None
+
+
+def write_csv(df: pd.DataFrame, dest: "str | Path | BinaryIO", include_header: bool = True) -> None:
+    """
+    Write df without its index to a path or a binary file handle (e.g. one opened with mode "ab").
+    pyarrow writes frames whose columns are all integer, float or string (categoricals included). Their
+    text matches pandas: same float formatting and quoting, "\n" line endings. Frames with any other column
+    type (bool, datetime, ...) are written by pandas.
+    """
+    if isinstance(dest, (str, Path)) and str(dest).endswith(".gz"):
+        with gzip.open(dest, "wb", compresslevel=1) as f:
+            write_csv(df, f, include_header=include_header)
+        return
+    if pa is not None:
+        if isinstance(dest, (str, Path)):
+            with open(dest, "wb") as f:
+                write_csv(df, f, include_header=include_header)
+            return
+        table = pa.Table.from_pandas(df, preserve_index=False)
+        # Categorical columns arrive dictionary-encoded; write their plain values.
+        for i, field in enumerate(table.schema):
+            if pa.types.is_dictionary(field.type):
+                table = table.set_column(i, field.name, table.column(i).cast(field.type.value_type))
+        # pyarrow formats other types differently (e.g. bool as true/false); leave those frames to pandas.
+        supported = all(
+            pa.types.is_integer(t) or pa.types.is_floating(t) or pa.types.is_string(t) or pa.types.is_large_string(t)
+            for t in table.schema.types
+        )
+        # Unquoted output matches pandas; pyarrow's quoting mode would quote every value, so frames with a
+        # comma, quote or newline in some string are left to pandas below.
+        needs_quotes = supported and any(
+            pc.any(pc.match_substring_regex(col, r'[",\r\n]')).as_py()
+            for col in table.columns
+            if pa.types.is_string(col.type) or pa.types.is_large_string(col.type)
+        )
+        if supported and not needs_quotes:
+            if include_header:
+                header = io.StringIO()
+                csv.writer(header, lineterminator="\n").writerow(table.column_names)
+                dest.write(header.getvalue().encode("utf-8"))
+            # pyarrow drops the ".0" on whole floats (33.0 -> 33); NumPy's shortest repr matches what pandas writes.
+            for i, field in enumerate(table.schema):
+                if pa.types.is_floating(field.type):
+                    values = table.column(i).to_numpy()
+                    table = table.set_column(i, field.name, pa.array(values.astype(str), mask=np.isnan(values)))
+            options = pacsv.WriteOptions(include_header=False, quoting_style="none")
+            pacsv.write_csv(table, dest, write_options=options)
+            return
+    df.to_csv(dest, index=False, header=include_header, lineterminator="\n")
@@ -14,12 +14,20 @@ Computational basis: docs/PIPELINE-COMPUTATIONAL-BASIS.md.
 import argparse
 import os
 import sys
+import zlib
+from collections.abc import Iterator
 from pathlib import Path
 
 import numpy as np
 import pandas as pd
-from sklearn.cluster import KMeans
-from sklearn.preprocessing import MinMaxScaler
+from sklearn.cluster import MiniBatchKMeans
+
+from pipeline_csv import write_csv
+
+try:
+    from numba import njit
+except ImportError:  # optional; sklearn MiniBatchKMeans is used instead
+    njit = None
 
 
 def load_data(path: str) -> pd.DataFrame:
@@ -36,6 +44,9 @@ def load_data(path: str) -> pd.DataFrame:
         df["density"] = 0.0
     if "population" not in df.columns:
         df["population"] = 0
+    # Categorical ids and real dates: sort/groupby compare int codes and datetimes instead of Python strings.
+    df["barangay_id"] = df["barangay_id"].astype("category")
+    df["date"] = pd.to_datetime(df["date"], format="%Y-%m-%d", cache=True)
     return df
 
 
@@ -50,9 +61,22 @@ def prepare_features(
     """
     df = df.sort_values(["barangay_id", "date"]).copy()
 
-    if use_rolling and df["date"].nunique() > 1:
-        df["temp_rolling"] = df.groupby("barangay_id")["temperature"].transform(
-            lambda x: x.rolling(window=window, min_periods=1).mean()
+    by_barangay = df.groupby("barangay_id", sort=False, observed=True)
+    # Longest per-barangay history; 0 or 1 means a single-day run and rolling is skipped entirely.
+    max_days = int(by_barangay.size().max()) if use_rolling and df["date"].nunique() > 1 else 0
+    if max_days > 1 and max_days <= window:
+        # No history is longer than the window, so the rolling mean is the expanding (cumulative) mean.
+        temp = df["temperature"]
+        sums = temp.fillna(0).groupby(df["barangay_id"], sort=False, observed=True).cumsum()
+        counts = temp.notna().groupby(df["barangay_id"], sort=False, observed=True).cumsum()
+        df["temp_rolling"] = sums / counts.where(counts > 0)
+    elif max_days > window:
+        # GroupBy.rolling runs the rolling-mean kernel per group without a Python callback; rows are already sorted.
+        df["temp_rolling"] = (
+            by_barangay["temperature"]
+            .rolling(window=window, min_periods=1)
+            .mean()
+            .reset_index(level=0, drop=True)
         )
     else:
         df["temp_rolling"] = df["temperature"]
@@ -68,14 +92,104 @@ def prepare_features(
         feature_cols = ["temp_rolling", "facility_score"]
         weights = np.array([0.5, 0.5])  # Equal weight approach (EWA), validated
 
-    features = df[feature_cols].copy()
-    features = features.fillna(features.mean(numeric_only=True))
-    scaler = MinMaxScaler()
-    features_scaled = scaler.fit_transform(features)
+    # Min-max scale to [0, 1] in place on one float32 copy (same result as MinMaxScaler; NaN -> column mean).
+    X = df[feature_cols].to_numpy(dtype=np.float32, copy=True)
+    nan_idx = np.where(np.isnan(X))
+    if nan_idx[0].size:
+        X[nan_idx] = np.take(np.nanmean(X, axis=0), nan_idx[1])
+    col_min = X.min(axis=0)
+    col_range = X.max(axis=0) - col_min
+    col_range[col_range == 0] = 1.0  # constant feature -> 0, as MinMaxScaler does
+    X -= col_min
+    X /= col_range
+    features_scaled = X
 
     return df, features_scaled, feature_cols, weights
 
 
+if njit is not None:
+
+    @njit(cache=True, fastmath=True)
+    def _lloyd(X: np.ndarray, centers: np.ndarray, max_iter: int, tol: float) -> np.ndarray:
+        """Lloyd iterations in one pass per iteration (assign + accumulate); centers are updated in place."""
+        n, d = X.shape
+        k = centers.shape[0]
+        labels = np.zeros(n, dtype=np.int64)
+        for _ in range(max_iter):
+            sums = np.zeros((k, d), dtype=np.float64)
+            counts = np.zeros(k, dtype=np.int64)
+            for i in range(n):
+                best = 0
+                best_dist = np.inf
+                for c in range(k):
+                    dist = 0.0
+                    for j in range(d):
+                        diff = X[i, j] - centers[c, j]
+                        dist += diff * diff
+                    if dist < best_dist:
+                        best_dist = dist
+                        best = c
+                labels[i] = best
+                counts[best] += 1
+                for j in range(d):
+                    sums[best, j] += X[i, j]
+            shift = 0.0
+            for c in range(k):
+                if counts[c] > 0:
+                    for j in range(d):
+                        new = sums[c, j] / counts[c]
+                        shift += (new - centers[c, j]) ** 2
+                        centers[c, j] = new
+            if shift <= tol:
+                break
+        return labels
+
+
+def _kmeans_plusplus(X: np.ndarray, n_clusters: int, rng: np.random.Generator) -> np.ndarray:
+    """k-means++ seeding: each next center drawn with probability proportional to squared distance."""
+    centers = np.empty((n_clusters, X.shape[1]), dtype=np.float64)
+    centers[0] = X[rng.integers(len(X))]
+    closest = ((X - centers[0]) ** 2).sum(axis=1)
+    for c in range(1, n_clusters):
+        total = closest.sum()
+        idx = rng.choice(len(X), p=closest / total) if total > 0 else rng.integers(len(X))
+        centers[c] = X[idx]
+        closest = np.minimum(closest, ((X - centers[c]) ** 2).sum(axis=1))
+    return centers
+
+
+def fit_predict_clusters(
+    features_scaled: np.ndarray,
+    n_clusters: int = 5,
+    random_state: int = 42,
+    n_init: int = 3,
+) -> np.ndarray:
+    """
+    Cluster labels for the scaled features. With numba installed and at most 3 features, runs a compiled
+    Lloyd's loop (best inertia of n_init k-means++ seedings); otherwise sklearn MiniBatchKMeans.
+    """
+    if njit is None or features_scaled.shape[1] > 3:
+        kmeans = MiniBatchKMeans(
+            n_clusters=n_clusters,
+            batch_size=min(1024, len(features_scaled)),
+            n_init=n_init,
+            random_state=random_state,
+            reassignment_ratio=0.01,
+        )
+        return kmeans.fit_predict(features_scaled)
+
+    X = np.ascontiguousarray(features_scaled, dtype=np.float32)
+    rng = np.random.default_rng(random_state)
+    best_labels, best_inertia = None, np.inf
+    for _ in range(n_init):
+        centers = _kmeans_plusplus(X, n_clusters, rng)
+        labels = _lloyd(X, centers, 300, 1e-8)
+        inertia = float(((X - centers[labels]) ** 2).sum())
+        if inertia < best_inertia:
+            best_labels, best_inertia = labels, inertia
+    return best_labels
+
+
 def run_kmeans_and_risk_levels(
     df: pd.DataFrame,
     features_scaled: np.ndarray,
@@ -85,18 +199,38 @@ def run_kmeans_and_risk_levels(
     random_state: int = 42,
 ) -> pd.DataFrame:
     """Assign clusters and map to PAGASA risk levels 1–5 by weighted severity."""
-    kmeans = KMeans(n_clusters=n_clusters, random_state=random_state)
     df = df.copy()
-    df["cluster"] = kmeans.fit_predict(features_scaled)
+    df["cluster"] = fit_predict_clusters(features_scaled, n_clusters, random_state).astype(np.int8)
 
-    cluster_means = df.groupby("cluster")[feature_cols].mean()
+    # Group only the columns the severity score needs (k <= 127 clusters fit the int8 key).
+    cluster_means = df[["cluster", *feature_cols]].groupby("cluster", observed=True).mean()
     cluster_means["severity_score"] = cluster_means.dot(weights)
     cluster_rank = cluster_means["severity_score"].rank(method="first", ascending=True).astype(int).to_dict()
-    df["risk_level"] = df["cluster"].map(lambda x: int(cluster_rank[x]))
+    rank_arr = np.zeros(n_clusters, dtype=np.int8)  # cluster label -> risk level 1–5
+    for c, r in cluster_rank.items():
+        rank_arr[int(c)] = int(r)
+    df["risk_level"] = rank_arr[df["cluster"].to_numpy()]
 
     return df
 
 
+def iter_gzip(path: Path, chunk_size: int = 1 << 16) -> Iterator[bytes]:
+    """
+    Yield the file gzip-compressed in chunks so an upload never holds the whole body in memory.
+    A .gz file is already compressed and is passed through as-is.
+    """
+    with path.open("rb") as f:
+        if path.suffix == ".gz":
+            while chunk := f.read(chunk_size):
+                yield chunk
+            return
+        compressor = zlib.compressobj(wbits=31)  # 31 = gzip container
+        while chunk := f.read(chunk_size):
+            if out := compressor.compress(chunk):
+                yield out
+    yield compressor.flush()
+
+
 def main() -> int:
     parser = argparse.ArgumentParser(description="Weighted heat risk pipeline (K-Means + PAGASA levels)")
     parser.add_argument(
@@ -107,7 +241,7 @@ def main() -> int:
     parser.add_argument(
         "--output",
         default="barangay_heat_risk_today.csv",
-        help="Output CSV with barangay_id, risk_level, cluster",
+        help="Output CSV with barangay_id, risk_level, cluster (gzip-compressed if the path ends in .gz)",
     )
     parser.add_argument(
         "--no-rolling",
@@ -139,8 +273,9 @@ def main() -> int:
 
     latest_date = df["date"].max()
     df_latest = df[df["date"] == latest_date][["barangay_id", "risk_level", "cluster"]]
-    df_latest.to_csv(args.output, index=False)
-    print(f"Latest date: {latest_date}; wrote {len(df_latest)} rows to {args.output}", flush=True)
+    df_latest = df_latest.assign(barangay_id=df_latest["barangay_id"].astype(str))
+    write_csv(df_latest, args.output)
+    print(f"Latest date: {latest_date:%Y-%m-%d}; wrote {len(df_latest)} rows to {args.output}", flush=True)
 
     # Optional: upload report to backend so users can download via frontend (no file in repo).
     backend_url = os.environ.get("BACKEND_URL", "").rstrip("/")
@@ -149,13 +284,13 @@ def main() -> int:
             import requests
             csv_path = Path(args.output)
             if csv_path.exists():
-                csv_body = csv_path.read_text(encoding="utf-8")
                 url = f"{backend_url}/api/heat/davao/pipeline-report"
-                headers = {"Content-Type": "text/csv"}
+                # Streamed and gzipped chunk by chunk; the backend's raw body parser inflates it.
+                headers = {"Content-Type": "text/csv", "Content-Encoding": "gzip"}
                 key = os.environ.get("PIPELINE_REPORT_WRITER_KEY")
                 if key:
                     headers["x-pipeline-report-key"] = key
-                r = requests.post(url, data=csv_body, headers=headers, timeout=30)
+                r = requests.post(url, data=iter_gzip(csv_path), headers=headers, timeout=(3, 30))  # (connect, read)
                 r.raise_for_status()
                 print("Uploaded report to backend; users can download via GET /api/heat/davao/pipeline-report.", flush=True)
             else:
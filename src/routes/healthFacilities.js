@@ -7,6 +7,7 @@
 import { Router } from "express";
 import { redis } from "../lib/redis.js";
 import { assessFacilitiesInBarangay } from "../services/facilitiesByBarangay.js";
+import { getDavaoBarangayGeo, getBarangayCentroids } from "../lib/barangays.js";
 import { FACILITIES_KEY } from "../lib/constants.js";
 
 const router = Router();
@@ -54,12 +55,15 @@ router.get("/facilities", async (req, res) => {
   }
 });
 
-/** POST /api/facilities/counts-by-barangays – batch facility counts for many barangays (e.g. for AI pipeline). Body: { "barangayIds": ["id1", "id2", ...] }. Response: { "counts": { "id1": 3, "id2": 0, ... } }. */
+/** POST /api/facilities/counts-by-barangays – batch facility counts for many barangays (e.g. for AI pipeline). Body: { "barangayIds": ["id1", "id2", ...] }; an empty array means all Davao barangays. Response: { "counts": { "id1": 3, "id2": 0, ... } }. */
 router.post("/facilities/counts-by-barangays", async (req, res) => {
   try {
-    const ids = req.body?.barangayIds;
-    if (!Array.isArray(ids) || ids.length === 0) {
-      return res.status(400).json({ error: "barangayIds array required and non-empty" });
+    let ids = req.body?.barangayIds;
+    if (!Array.isArray(ids)) {
+      return res.status(400).json({ error: "barangayIds array required" });
+    }
+    if (ids.length === 0) {
+      ids = getBarangayCentroids(await getDavaoBarangayGeo()).map((c) => c.barangayId);
     }
     const facilities = await getFacilities();
     const counts = {};
@@ -243,7 +243,7 @@ router.post("/heat/:cityId/pipeline-report/generate", async (req, res) => {
 /**
  * POST /api/heat/:cityId/pipeline-report
  * Upload the latest pipeline heat-risk report CSV (e.g. from ai/run_pipeline.cmd).
- * Body: raw CSV. If PIPELINE_REPORT_WRITER_KEY is set, require header x-pipeline-report-key.
+ * Body: raw CSV (may be sent with Content-Encoding: gzip). If PIPELINE_REPORT_WRITER_KEY is set, require header x-pipeline-report-key.
  * Report is stored in Redis and served by GET for frontend download.
  */
 router.post(